@@ -1,15 +1,37 @@
 import boto3
 import json
 import botocore
+import botocore.session
+import functools
+import io
+import math
 import os
+import threading
+import time
 import uuid
-from fpdf import FPDF
-from datetime import datetime
+from botocore.config import Config
+from botocore.credentials import AssumeRoleCredentialFetcher, DeferredRefreshableCredentials
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+# Shared client config: keep connections alive, pool them across threads, back off under throttling
+BOTO_CFG = Config(
+    tcp_keepalive=True,
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "max_attempts": 10},
+    connect_timeout=3,
+    read_timeout=10
+)
 
 # Initialize AWS clients
-sts_client = boto3.client("sts")
-sns_client = boto3.client("sns")
-s3_client = boto3.client("s3")
+sts_client = boto3.client("sts", config=BOTO_CFG)
+sns_client = boto3.client("sns", config=BOTO_CFG)
+# Regional SigV4 client with virtual-hosted addressing so presigned report links need no redirect
+s3_client = boto3.client(
+    "s3",
+    region_name=os.environ.get("AWS_REGION"),
+    config=BOTO_CFG.merge(Config(signature_version="s3v4", s3={"addressing_style": "virtual"}))
+)
 
 # Environment variables in Lambda
 SNS_TOPIC_ARN = os.environ.get("SNS_TOPIC_ARN")
@@ -19,38 +41,85 @@ BUCKET_NAME = os.environ["PDF_REPORT_BUCKET"]  # set in Lambda env vars
 if not SNS_TOPIC_ARN or not ASSUMABLE_ROLE_NAME:
     raise ValueError("SNS_TOPIC_ARN and ASSUMABLE_ROLE_NAME environment variables must be set!")
 
-date_str = datetime.utcnow().strftime("%Y-%m-%d")
-pdf_path = "/tmp/cost_optimization_report.pdf"
-
-# Function to assume role in target account
-def assume_role(account_id, role_name="CrossAccountAccessRole"):
-    role_arn = f"arn:aws:iam::{account_id}:role/{role_name}"
+# Upper bound on accounts scanned in parallel
+MAX_ACCOUNT_WORKERS = 32
+
+# How far back CloudWatch metrics are evaluated
+METRIC_LOOKBACK_DAYS = 30
+
+# Assumed-role sessions per account, kept at module scope so warm invocations reuse them
+_SESSION_CACHE = {}
+_SESSION_CACHE_LOCK = threading.Lock()
+
+# Account the Lambda itself runs in, looked up once per container
+_CALLER_ACCOUNT_ID = None
+
+# Function to get the account ID of the Lambda's own credentials
+def get_caller_account():
+    """Return the caller's account ID, calling STS only on first use.
+
+    lambda_handler resolves this before scanning accounts, so worker threads only read the cached value.
+    """
+    global _CALLER_ACCOUNT_ID
+    if _CALLER_ACCOUNT_ID is None:
+        _CALLER_ACCOUNT_ID = sts_client.get_caller_identity()["Account"]
+    return _CALLER_ACCOUNT_ID
+
+# Function to get a session for the assumable role in a target account
+def get_account_session(account_id):
+    """Return a cached boto3 session whose credentials assume the role in the account and refresh before expiry.
+
+    The Lambda's own account uses the ambient credentials directly, skipping AssumeRole.
+    """
+    with _SESSION_CACHE_LOCK:
+        session = _SESSION_CACHE.get(account_id)
+        if session is not None:
+            return session
+
+        if account_id == get_caller_account():
+            session = boto3.session.Session()
+            _SESSION_CACHE[account_id] = session
+            return session
+
+        # One botocore session per account: it resolves the Lambda's own credentials for the STS
+        # client that assumes the role, then carries the assumed-role credentials for service clients
+        botocore_session = botocore.session.get_session()
+        fetcher = AssumeRoleCredentialFetcher(
+            client_creator=functools.partial(botocore_session.create_client, config=BOTO_CFG),
+            source_credentials=botocore_session.get_credentials(),
+            role_arn=f"arn:aws:iam::{account_id}:role/{ASSUMABLE_ROLE_NAME}",
+            extra_args={"RoleSessionName": "CostOptimizationSession"}
+        )
+        credentials = DeferredRefreshableCredentials(
+            method="assume-role",
+            refresh_using=fetcher.fetch_credentials
+        )
 
-    """Assume a role in a different AWS account and return temporary credentials."""
-    response = sts_client.assume_role(
-        RoleArn=f"arn:aws:iam::{account_id}:role/{ASSUMABLE_ROLE_NAME}",
-        RoleSessionName="CostOptimizationSession"
-    )
-    return response["Credentials"]
+        # botocore has no public setter for a ready-made credentials object (set_credentials only takes
+        # static keys). Swapping them in is safe: the fetcher above already holds the source credentials
+        # and passes them to create_client explicitly whenever it builds its STS client.
+        botocore_session._credentials = credentials
+        session = boto3.session.Session(botocore_session=botocore_session)
+        _SESSION_CACHE[account_id] = session
+        return session
 
 # Function to get AWS clients for a specific account
-def get_clients(credentials):
-    """Return AWS service clients using assumed role credentials."""
-    session = boto3.session.Session(
-        aws_access_key_id=credentials["AccessKeyId"],
-        aws_secret_access_key=credentials["SecretAccessKey"],
-        aws_session_token=credentials["SessionToken"]
-    )
+def get_clients(session):
+    """Return AWS service clients built from the account's session."""
     return {
-        "ec2": session.client("ec2"),
-        "cloudwatch": session.client("cloudwatch"),
-        "rds": session.client("rds"),
-        "s3": session.client("s3")
+        "ec2": session.client("ec2", config=BOTO_CFG),
+        "cloudwatch": session.client("cloudwatch", config=BOTO_CFG),
+        "rds": session.client("rds", config=BOTO_CFG),
+        "s3": session.client("s3", config=BOTO_CFG),
+        "compute-optimizer": session.client("compute-optimizer", config=BOTO_CFG)
     }
 
 # Function to generate a PDF report
 def generate_pdf_report(recommendations):
-    """Create a PDF report summarizing the cost optimization findings."""
+    """Create a PDF report summarizing the cost optimization findings and return it as bytes."""
+    # Imported here so cold starts that end without a report never load fpdf
+    from fpdf import FPDF
+
     pdf = FPDF()
     pdf.set_auto_page_break(auto=True, margin=15)
     pdf.add_page()
@@ -68,138 +137,283 @@ def generate_pdf_report(recommendations):
             pdf.cell(200, 8, f"{category}", ln=True, align='L')
             pdf.set_font("Arial", "", 10)
             
+            # One multi_cell per category lays out all of its rows in a single call
             if items:
-                for item in items:
-                    pdf.cell(200, 6, f"- {item}", ln=True, align='L')
+                lines = "\n".join(f"- {item}" for item in items)
             else:
-                pdf.cell(200, 6, "- No optimizations found", ln=True, align='L')
+                lines = "- No optimizations found"
+            pdf.multi_cell(200, 6, lines, align='L')
             pdf.ln(5)
     
-    pdf_output_path = f"/tmp/cost_optimization_report_{uuid.uuid4().hex}.pdf"
-    pdf.output(pdf_output_path)
-    return pdf_output_path
+    # PyFPDF returns a latin-1 str for dest="S"; fpdf2 returns a bytearray
+    output = pdf.output(dest="S")
+    if isinstance(output, str):
+        output = output.encode("latin-1")
+    return bytes(output)
 
 # Function to check if a timestamp falls on a weekend
 def is_weekend(timestamp):
     return timestamp.weekday() >= 5  # Saturday (5) or Sunday (6)
 
-# Function to retrieve P95 percentile metric
-def get_percentile_metric(client, instance_id, namespace, metric_name, dimension_name, percentile="p95.0", period=86400, days=30):
-    """Retrieve the specified percentile for a given metric."""
-    response = client.get_metric_statistics(
+# Maximum number of MetricDataQuery entries allowed per GetMetricData request
+METRIC_DATA_BATCH_SIZE = 500
+
+# Maximum number of datapoints a single GetMetricData response can return
+METRIC_DATA_MAX_DATAPOINTS = 100800
+
+# Function to find which resources actually publish a metric
+def get_reporting_resource_ids(client, namespace, metric_name, dimension_name):
+    """Return the set of dimension values that have the metric in CloudWatch."""
+    resource_ids = set()
+    pages = client.get_paginator("list_metrics").paginate(
         Namespace=namespace,
         MetricName=metric_name,
-        Dimensions=[{"Name": dimension_name, "Value": instance_id}],
-        StartTime=datetime.datetime.utcnow() - datetime.timedelta(days=days),
-        EndTime=datetime.datetime.utcnow(),
-        Period=period,
-        ExtendedStatistics=[percentile]
+        Dimensions=[{"Name": dimension_name}]
     )
-    return response.get('Datapoints', [])
+    for page in pages:
+        resource_ids.update(
+            dimension["Value"]
+            for metric in page["Metrics"]
+            for dimension in metric["Dimensions"]
+            if dimension["Name"] == dimension_name
+        )
+    return resource_ids
+
+# Function to retrieve P95 percentile metrics for many resources at once
+def get_percentile_metrics(client, resource_ids, namespace, metric_name, dimension_name, start_time, end_time, percentile="p95", period=86400):
+    """Retrieve the specified percentile for a metric across many resources using batched GetMetricData calls.
+
+    Returns a dict mapping each resource ID to a list of (timestamp, value) pairs. Resources
+    that publish no such metric are not queried and map to an empty list.
+    """
+    results = {resource_id: [] for resource_id in resource_ids}
+    if not resource_ids:
+        return results
+
+    reporting = get_reporting_resource_ids(client, namespace, metric_name, dimension_name)
+    queried_ids = [resource_id for resource_id in resource_ids if resource_id in reporting]
+
+    # Keep each batch within one response so a long window or short period does not force NextToken pages
+    points_per_query = max(1, math.ceil((end_time - start_time).total_seconds() / period))
+    batch_size = max(1, min(METRIC_DATA_BATCH_SIZE, METRIC_DATA_MAX_DATAPOINTS // points_per_query))
+
+    for offset in range(0, len(queried_ids), batch_size):
+        chunk = queried_ids[offset:offset + batch_size]
+        query_ids = {f"m{i}": resource_id for i, resource_id in enumerate(chunk)}
+        queries = [
+            {
+                "Id": query_id,
+                "MetricStat": {
+                    "Metric": {
+                        "Namespace": namespace,
+                        "MetricName": metric_name,
+                        "Dimensions": [{"Name": dimension_name, "Value": resource_id}]
+                    },
+                    "Period": period,
+                    "Stat": percentile
+                },
+                "ReturnData": True
+            }
+            for query_id, resource_id in query_ids.items()
+        ]
+
+        kwargs = {
+            "MetricDataQueries": queries,
+            "StartTime": start_time,
+            "EndTime": end_time,
+            "ScanBy": "TimestampAscending"
+        }
+        while True:
+            response = client.get_metric_data(**kwargs)
+            for result in response.get("MetricDataResults", []):
+                resource_id = query_ids[result["Id"]]
+                results[resource_id].extend(zip(result.get("Timestamps", []), result.get("Values", [])))
+
+            next_token = response.get("NextToken")
+            if not next_token:
+                break
+            kwargs["NextToken"] = next_token
+
+    return results
+
+# Function to decide whether a resource stays below the threshold on weekdays and weekends
+def is_underutilized(datapoints, threshold):
+    """Return True if both the weekday and weekend P95 averages are below the threshold."""
+    if not datapoints:
+        return False
+
+    # Index 0 accumulates weekdays, index 1 weekends, in a single pass
+    totals = [0.0, 0.0]
+    counts = [0, 0]
+    for timestamp, value in datapoints:
+        bucket = is_weekend(timestamp)
+        totals[bucket] += value
+        counts[bucket] += 1
+
+    weekday_avg = totals[0] / counts[0] if counts[0] else 0
+    weekend_avg = totals[1] / counts[1] if counts[1] else 0
+
+    return weekday_avg < threshold and weekend_avg < threshold
 
 # Function to find low-utilization EC2 instances
-def get_low_utilization_ec2(clients, threshold=5, period=86400, days=30):
+def get_low_utilization_ec2(clients, start_time, end_time, threshold=5, period=86400):
     """Find EC2 instances with low CPU usage using P95 percentiles."""
-    instances = clients["ec2"].describe_instances(Filters=[{"Name": "instance-state-name", "Values": ["running"]}])
-    underutilized = []
-
-    for reservation in instances["Reservations"]:
-        for instance in reservation["Instances"]:
-            instance_id = instance["InstanceId"]
-            datapoints = get_percentile_metric(
-                clients["cloudwatch"],
-                instance_id,
-                "AWS/EC2",
-                "CPUUtilization",
-                "InstanceId",
-                "p95",
-                period,
-                days
-            )
-
-            if not datapoints:
-                continue  # Skip instance if no data
-
-            weekday_usage = [data.get('ExtendedStatistics', {}).get('p95.0') or data.get('p95.0') for data in datapoints if not is_weekend(data['Timestamp'])]
-            weekend_usage = [data.get('ExtendedStatistics', {}).get('p95.0') or data.get('p95.0') for data in datapoints if is_weekend(data['Timestamp'])]
-
-            # Filter out None values
-            weekday_usage = [v for v in weekday_usage if v is not None]
-            weekend_usage = [v for v in weekend_usage if v is not None]
-
-            if not weekday_usage and not weekend_usage:
-                continue
-
-            weekday_avg = sum(weekday_usage) / len(weekday_usage) if weekday_usage else 0
-            weekend_avg = sum(weekend_usage) / len(weekend_usage) if weekend_usage else 0
-
-            if weekday_avg < threshold and weekend_avg < threshold:
-                underutilized.append(instance_id)
+    pages = clients["ec2"].get_paginator("describe_instances").paginate(
+        Filters=[{"Name": "instance-state-name", "Values": ["running"]}],
+        PaginationConfig={"PageSize": 1000}
+    )
+    instance_ids = [
+        instance["InstanceId"]
+        for page in pages
+        for reservation in page["Reservations"]
+        for instance in reservation["Instances"]
+    ]
+
+    metrics = get_percentile_metrics(
+        clients["cloudwatch"],
+        instance_ids,
+        "AWS/EC2",
+        "CPUUtilization",
+        "InstanceId",
+        start_time,
+        end_time,
+        "p95",
+        period
+    )
 
-    return underutilized
+    return [instance_id for instance_id in instance_ids if is_underutilized(metrics[instance_id], threshold)]
 
 
 # Function to identify underutilized RDS instances
-def get_low_utilization_rds(clients, threshold=10, period=86400, days=30):
+def get_low_utilization_rds(clients, start_time, end_time, threshold=10, period=86400):
     """Find RDS instances with low CPU usage using P95 percentiles."""
-    databases = clients["rds"].describe_db_instances()
-    underutilized = []
-
-    for db in databases["DBInstances"]:
-        db_id = db["DBInstanceIdentifier"]
-        datapoints = get_percentile_metric(
-            clients["cloudwatch"],
-            db_id,
-            "AWS/RDS",
-            "CPUUtilization",
-            "DBInstanceIdentifier",
-            "p95",
-            period,
-            days
-        )
-
-        if not datapoints:
-            continue
-
-        weekday_usage = [data.get('ExtendedStatistics', {}).get('p95.0') or data.get('p95.0') for data in datapoints if not is_weekend(data['Timestamp'])]
-        weekend_usage = [data.get('ExtendedStatistics', {}).get('p95.0') or data.get('p95.0') for data in datapoints if is_weekend(data['Timestamp'])]
-
-        weekday_usage = [v for v in weekday_usage if v is not None]
-        weekend_usage = [v for v in weekend_usage if v is not None]
-
-        if not weekday_usage and not weekend_usage:
-            continue
-
-        weekday_avg = sum(weekday_usage) / len(weekday_usage) if weekday_usage else 0
-        weekend_avg = sum(weekend_usage) / len(weekend_usage) if weekend_usage else 0
-
-        if weekday_avg < threshold and weekend_avg < threshold:
-            underutilized.append(db_id)
-
-    return underutilized
+    # DescribeDBInstances caps MaxRecords at 100
+    pages = clients["rds"].get_paginator("describe_db_instances").paginate(
+        PaginationConfig={"PageSize": 100}
+    )
+    db_ids = [db["DBInstanceIdentifier"] for page in pages for db in page["DBInstances"]]
+
+    metrics = get_percentile_metrics(
+        clients["cloudwatch"],
+        db_ids,
+        "AWS/RDS",
+        "CPUUtilization",
+        "DBInstanceIdentifier",
+        start_time,
+        end_time,
+        "p95",
+        period
+    )
 
+    return [db_id for db_id in db_ids if is_underutilized(metrics[db_id], threshold)]
+
+
+# Function to check whether Compute Optimizer has recommendations for the account
+def is_compute_optimizer_active(clients):
+    """Return True if the account is opted in to Compute Optimizer and the role can read its status."""
+    try:
+        return clients["compute-optimizer"].get_enrollment_status()["status"] == "Active"
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+        print(f"Compute Optimizer unavailable, falling back to CloudWatch: {e}")
+        return False
+
+# Function to page through a Compute Optimizer recommendations API
+def get_compute_optimizer_recommendations(method, result_key):
+    """Yield every recommendation returned by the given Compute Optimizer call, following nextToken."""
+    kwargs = {}
+    while True:
+        response = method(**kwargs)
+        yield from response.get(result_key, [])
+
+        next_token = response.get("nextToken")
+        if not next_token:
+            break
+        kwargs["nextToken"] = next_token
+
+# Function to find over-provisioned EC2 instances via Compute Optimizer
+def get_overprovisioned_ec2(clients):
+    """Find EC2 instances that Compute Optimizer flags as over-provisioned."""
+    recommendations = get_compute_optimizer_recommendations(
+        clients["compute-optimizer"].get_ec2_instance_recommendations,
+        "instanceRecommendations"
+    )
+    # instanceArn looks like arn:aws:ec2:<region>:<account>:instance/<instance-id>
+    return [r["instanceArn"].split("/")[-1] for r in recommendations if r.get("finding") == "Overprovisioned"]
+
+# Function to find over-provisioned RDS instances via Compute Optimizer
+def get_overprovisioned_rds(clients):
+    """Find RDS instances that Compute Optimizer flags as over-provisioned."""
+    recommendations = get_compute_optimizer_recommendations(
+        clients["compute-optimizer"].get_rds_database_recommendations,
+        "rdsDBRecommendations"
+    )
+    # resourceArn looks like arn:aws:rds:<region>:<account>:db:<db-instance-identifier>
+    return [r["resourceArn"].split(":")[-1] for r in recommendations if r.get("instanceFinding") == "Overprovisioned"]
+
+# Function to prefer Compute Optimizer findings for one service, falling back to CloudWatch on failure
+def get_underutilized_with_fallback(compute_optimizer_scan, cloudwatch_scan, clients, start_time, end_time):
+    """Run the Compute Optimizer scan, or the CloudWatch scan if its recommendations cannot be read."""
+    try:
+        return compute_optimizer_scan(clients)
+    except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+        print(f"{compute_optimizer_scan.__name__} failed, falling back to CloudWatch: {e}")
+        return cloudwatch_scan(clients, start_time, end_time)
+
+
+# Bucket listings and lifecycle rules rarely change, so warm invocations reuse them for a while
+S3_CACHE_TTL_SECONDS = 6 * 60 * 60
+_BUCKET_LIST_CACHE = {}  # account_id -> (fetched_at, bucket_names)
+_LIFECYCLE_CACHE = {}  # (account_id, bucket_name) -> (fetched_at, rules or None)
+
+# Function to list bucket names, cached per account
+def get_bucket_names(account_id, s3):
+    """Return the account's bucket names, reusing a cached listing younger than the TTL."""
+    now = time.time()
+    entry = _BUCKET_LIST_CACHE.get(account_id)
+    if entry and now - entry[0] < S3_CACHE_TTL_SECONDS:
+        return entry[1]
+
+    bucket_names = [bucket["Name"] for bucket in s3.list_buckets()["Buckets"]]
+    _BUCKET_LIST_CACHE[account_id] = (now, bucket_names)
+    return bucket_names
+
+# Function to get a bucket's lifecycle rules, cached per account and bucket
+def get_lifecycle_rules(account_id, bucket_name, s3):
+    """Return the bucket's lifecycle rules, or None if it has no lifecycle configuration."""
+    now = time.time()
+    entry = _LIFECYCLE_CACHE.get((account_id, bucket_name))
+    if entry and now - entry[0] < S3_CACHE_TTL_SECONDS:
+        return entry[1]
+
+    try:
+        rules = s3.get_bucket_lifecycle_configuration(Bucket=bucket_name).get("Rules")
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] == "NoSuchLifecycleConfiguration":
+            rules = None
+        else:
+            raise
+
+    _LIFECYCLE_CACHE[(account_id, bucket_name)] = (now, rules)
+    return rules
 
 # Function to identify S3 storage savings
-def get_s3_storage_savings(clients):
+def get_s3_storage_savings(clients, account_id):
     """Find S3 buckets that could benefit from lifecycle policies."""
-    buckets = clients["s3"].list_buckets()
     savings = {}
 
-    for bucket in buckets["Buckets"]:
-        bucket_name = bucket["Name"]
+    for bucket_name in get_bucket_names(account_id, clients["s3"]):
         try:
-            response = clients["s3"].get_bucket_lifecycle_configuration(Bucket=bucket_name)
-            if response.get("Rules"):
+            if get_lifecycle_rules(account_id, bucket_name, clients["s3"]):
                 savings[bucket_name] = "Consider moving infrequent objects to S3 Intelligent-Tiering."
         except botocore.exceptions.ClientError as e:
-            if e.response["Error"]["Code"] == "NoSuchLifecycleConfiguration":
-                continue  
-            else:
-                print(f"Error processing bucket {bucket_name}: {e}")
-                continue
+            print(f"Error processing bucket {bucket_name}: {e}")
+            continue
 
     return savings
 
+# Characters of recommendations kept in the SNS message body
+SNS_MESSAGE_LIMIT = 250000
+
 # Function to send SNS notification
 def send_notification(message, presigned_url):
     """Send cost optimization recommendations via SNS with a formatted message."""
@@ -207,14 +421,21 @@ def send_notification(message, presigned_url):
     if not message:
         formatted_message = "No cost optimization recommendations found."
     else:
-        formatted_message = "\n".join(
-            [f"{category}:\n  - " + "\n  - ".join(items) if items else f"{category}:\n  - No optimizations found"
-             for category, items in message.items()]
-        )
+        # Write incrementally and stop once past the SNS size limit
+        buf = io.StringIO()
+        for account_id, details in message.items():
+            buf.write(f"Account {account_id}:\n")
+            for category, items in details.items():
+                buf.write(f"{category}:\n  - ")
+                buf.write("\n  - ".join(items) if items else "No optimizations found")
+                buf.write("\n")
+            if buf.tell() > SNS_MESSAGE_LIMIT:
+                break
+        formatted_message = buf.getvalue()
 
     # Truncate if too long for SNS limits
-    if len(formatted_message) > 250000:
-        formatted_message = formatted_message[:250000] + "\n\n[Message Truncated]"
+    if len(formatted_message) > SNS_MESSAGE_LIMIT:
+        formatted_message = formatted_message[:SNS_MESSAGE_LIMIT] + "\n\n[Message Truncated]"
 
     # Construct the final message body
     full_message = (
@@ -232,6 +453,35 @@ def send_notification(message, presigned_url):
 
 
 
+# Function to scan a single account for cost-saving opportunities
+def process_account(account_id, start_time, end_time):
+    """Get the account's session and run the EC2, RDS and S3 scans concurrently over the given metric window."""
+    clients = get_clients(get_account_session(account_id))
+
+    # Compute Optimizer already analyses utilization server-side; scan CloudWatch only when it is not enabled
+    use_compute_optimizer = is_compute_optimizer_active(clients)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        if use_compute_optimizer:
+            ec2_future = executor.submit(
+                get_underutilized_with_fallback, get_overprovisioned_ec2, get_low_utilization_ec2, clients, start_time, end_time
+            )
+            rds_future = executor.submit(
+                get_underutilized_with_fallback, get_overprovisioned_rds, get_low_utilization_rds, clients, start_time, end_time
+            )
+        else:
+            ec2_future = executor.submit(get_low_utilization_ec2, clients, start_time, end_time)
+            rds_future = executor.submit(get_low_utilization_rds, clients, start_time, end_time)
+        s3_future = executor.submit(get_s3_storage_savings, clients, account_id)
+
+        recommendations = {
+            "Underutilized EC2 Instances": ec2_future.result(),
+            "Underutilized RDS Databases": rds_future.result(),
+            "S3 Storage Optimization": s3_future.result(),
+        }
+
+    return account_id, recommendations
+
 # Main Lambda function
 def lambda_handler(event, context):
     """Main Lambda function to check for cost-saving opportunities across multiple accounts."""
@@ -241,40 +491,58 @@ def lambda_handler(event, context):
     if isinstance(accounts, str):  # If it's a single account ID as a string
         accounts = [accounts]
 
+    # Resolve the Lambda's own account once, before the workers need it for the same-account fast path
+    caller_account_id = get_caller_account()
+
     # If no accounts are provided, run in the current AWS account
     if not accounts:
-        accounts = [boto3.client("sts").get_caller_identity()["Account"]]
-
-    all_recommendations = {}
-
-    for account_id in accounts:
-        credentials = assume_role(account_id)
-        clients = get_clients(credentials)
-        
-        recommendations = {
-            "Underutilized EC2 Instances": get_low_utilization_ec2(clients),
-            "Underutilized RDS Databases": get_low_utilization_rds(clients),
-            "S3 Storage Optimization": get_s3_storage_savings(clients),
-        }
-        all_recommendations[account_id] = recommendations
-
-    # Generate PDF locally
-    pdf_path = generate_pdf_report(all_recommendations)
-
-    s3_key = f"reports/{account_id}/{os.path.basename(pdf_path)}_{date_str}"
-    s3_client.upload_file(pdf_path, BUCKET_NAME, s3_key)
+        accounts = [caller_account_id]
+
+    # One metric window for every query in this invocation
+    end_time = datetime.now(timezone.utc)
+    start_time = end_time - timedelta(days=METRIC_LOOKBACK_DAYS)
+    scan_account = functools.partial(process_account, start_time=start_time, end_time=end_time)
+
+    # Scan accounts concurrently; each worker gets its own account session
+    with ThreadPoolExecutor(max_workers=min(MAX_ACCOUNT_WORKERS, len(accounts))) as executor:
+        all_recommendations = dict(executor.map(scan_account, accounts))
+
+    # Nothing to report: skip the PDF, upload and presigned URL
+    has_any = any(items for details in all_recommendations.values() for items in details.values())
+    if not has_any:
+        sns_client.publish(
+            TopicArn=SNS_TOPIC_ARN,
+            Message="No cost optimization recommendations found.",
+            Subject="AWS Cost Optimization Recommendations"
+        )
+        print("No recommendations found; skipped PDF report")
+        return all_recommendations
+
+    # Generate PDF in memory and upload it straight to S3
+    pdf_bytes = generate_pdf_report(all_recommendations)
+
+    # One aggregated report per invocation, dated from this run rather than container start
+    date_str = end_time.strftime("%Y-%m-%d")
+    report_scope = accounts[0] if len(accounts) == 1 else "multi-account"
+    s3_key = f"reports/{report_scope}/cost_optimization_report_{date_str}_{uuid.uuid4().hex}.pdf"
+    s3_client.put_object(
+        Bucket=BUCKET_NAME,
+        Key=s3_key,
+        Body=pdf_bytes,
+        ContentType="application/pdf"
+    )
     print(f"✅ PDF report uploaded to {BUCKET_NAME}/{s3_key}")
 
     # Generate presigned URL
     presigned_url = s3_client.generate_presigned_url(
         "get_object",
         Params={"Bucket": BUCKET_NAME, "Key": s3_key},
-        ExpiresIn=3600
+        ExpiresIn=3600,
+        HttpMethod="GET"
     )
     print(f"🔗 Presigned URL: {presigned_url}")
 
     # Now send the email with link
     send_notification(all_recommendations, presigned_url)
-    pdf_path = generate_pdf_report(all_recommendations)
 
     return all_recommendations
\ No newline at end of file